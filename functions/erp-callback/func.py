@@ -12,6 +12,7 @@ import oci.object_storage
 from oci.object_storage.models import CopyObjectDetails
 import os.path
 import time
+import job_ledger
 
 
 def handler(ctx, data: io.BytesIO = None):
@@ -30,6 +31,7 @@ def handler(ctx, data: io.BytesIO = None):
         param_completed_bucket_name = cfg["succeeded_bucket_name"]
         param_failed_bucket_name = cfg["failed_bucket_name"]
         param_processing_bucket_name = cfg["processing_bucket_name"]
+        param_ledger_bucket_name = cfg["ledger_bucket_name"]
 
         param_ons_error_topic_ocid = cfg["ons_error_topic_ocid"]
         param_ons_info_topic_ocid = cfg["ons_info_topic_ocid"]
@@ -76,13 +78,25 @@ def handler(ctx, data: io.BytesIO = None):
     # Process callback
     try:
         # Move file from processing bucket to completed, or failed bucket
+        # The ledger records the name the file was given in the processing bucket, fall back to the naming convention
+        ledger = job_ledger.open_ledger(object_storage_client, namespace, param_ledger_bucket_name)
         data_file_name = erp_document_name + "_ERPJOBID_" + erp_request_id
+        try:
+            # Re-uploads of a file share its ledger entries, only use the entry recorded for this job
+            submitted = [e for e in ledger.lookup_job(erp_request_id)
+                         if e["stage"] == job_ledger.STAGE_SUBMITTED and e["erpJobId"] == erp_request_id]
+            if submitted and submitted[-1]["objectName"]:
+                data_file_name = submitted[-1]["objectName"]
+        except Exception as ex:
+            logging.warning(f'Unable to look up ERP job {erp_request_id} in the job ledger {ex}')
 
         # Move file to final location
         if erp_status.upper() == "SUCCEEDED":
             destination_bucket_name = param_completed_bucket_name
+            ledger_stage = job_ledger.STAGE_SUCCEEDED
         else:
             destination_bucket_name = param_failed_bucket_name
+            ledger_stage = job_ledger.STAGE_FAILED
         #
         logging.info("Moving file to bucket " + destination_bucket_name)
 
@@ -124,6 +138,10 @@ def handler(ctx, data: io.BytesIO = None):
         )
         return return_fn_error(ctx, response, message)
 
+    job_ledger.append_safely(ledger, data_file_name, ledger_stage,
+                             bucket=destination_bucket_name,
+                             object_name=data_file_name,
+                             erp_job_id=erp_request_id)
     # Publish successful load message to info topic
     additional_details={
                    "filename": data_file_name,
@@ -10,6 +10,7 @@ import base64
 from fdk import response
 import oci.object_storage
 import requests
+import job_ledger
 
 JSON_CONTENT_TYPE = "application/json"
 
@@ -31,6 +32,7 @@ def handler(ctx, data: io.BytesIO = None):
     try:
         param_inbound_bucket_name = cfg["zip_inbound_bucket_name"]
         param_processing_bucket_name = cfg["processing_bucket_name"]
+        param_ledger_bucket_name = cfg["ledger_bucket_name"]
         param_erp_url = cfg["erp_url"]
         param_erp_username = cfg["erp_username"]
         param_oci_password_vault_ocid = cfg["erp_password_vault_ocid"]
@@ -111,11 +113,18 @@ def handler(ctx, data: io.BytesIO = None):
     logging.info(f'ERP Job number {erp_job_id} submitted')
 
     # Copy object to processing bucket, renaming file as we go
+    processing_file_name = data_file_name + "_ERPJOBID_" + erp_job_id
     put_object_response = object_storage_client.put_object(namespace, param_processing_bucket_name,
-                                                           data_file_name + "_ERPJOBID_" + erp_job_id,
+                                                           processing_file_name,
                                                            data_file.data.content)
     logging.info(f'Response of put file to destination bucket {put_object_response.status}')
     if put_object_response.status == 200:
+        ledger = job_ledger.open_ledger(object_storage_client, namespace, param_ledger_bucket_name)
+        job_ledger.append_safely(ledger, data_file_name, job_ledger.STAGE_SUBMITTED,
+                                 bucket=param_processing_bucket_name,
+                                 object_name=processing_file_name,
+                                 erp_job_id=erp_job_id,
+                                 content=data_file.data.content)
         # If all good then delete original object
         delete_result = object_storage_client.delete_object(namespace, param_inbound_bucket_name, data_file_name)
         if delete_result.status != 204:
@@ -0,0 +1,81 @@
+# Copyright (c) 2021, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+
+import logging
+import io
+import json
+from urllib.parse import urlparse, parse_qs
+from fdk import response
+import oci.object_storage
+import job_ledger
+
+JSON_CONTENT_TYPE = "application/json"
+
+
+def handler(ctx, data: io.BytesIO = None):
+    logging.info("------------------------------------------------------------------------------")
+    logging.info("Within erp-job-status")
+    logging.info("------------------------------------------------------------------------------")
+
+    cfg = ctx.Config()
+    try:
+        param_ledger_bucket_name = cfg["ledger_bucket_name"]
+    except KeyError as ke:
+        message = f'Mandatory Configuration Parameter {ke} missing, please check all configuration parameters'
+        return return_fn_error(ctx, response, message)
+
+    # Query parameters when called through the API Gateway, or a JSON body when called with fn invoke
+    query = {}
+    request_url = ctx.RequestURL()
+    if request_url:
+        query = {key: values[0] for key, values in parse_qs(urlparse(request_url).query).items()}
+    if not query and data is not None and data.getvalue():
+        try:
+            query = json.loads(data.getvalue())
+        except json.decoder.JSONDecodeError as ex:
+            return return_fn_error(ctx, response, "JSON Exception Parsing request body", str(ex), status_code=400)
+
+    file_name = query.get("file")
+    erp_job_id = query.get("jobId")
+    if not file_name and not erp_job_id:
+        return return_fn_error(ctx, response, "Either the file or jobId query parameter must be provided",
+                               status_code=400)
+
+    signer = oci.auth.signers.get_resource_principals_signer()
+    object_storage_client = oci.object_storage.ObjectStorageClient(config={}, signer=signer)
+    namespace = object_storage_client.get_namespace().data
+    ledger = job_ledger.open_ledger(object_storage_client, namespace, param_ledger_bucket_name)
+
+    try:
+        if file_name:
+            entries = ledger.lookup_file(file_name)
+        else:
+            entries = ledger.lookup_job(erp_job_id)
+    except oci.exceptions.ServiceError as ex:
+        return return_fn_error(ctx, response, "Error reading the job ledger", str(ex))
+
+    status = job_ledger.file_status(entries, erp_job_id=None if file_name else str(erp_job_id))
+    if status is None:
+        return return_fn_error(ctx, response, f'No pipeline entries found for {file_name or erp_job_id}',
+                               status_code=404)
+
+    return response.Response(
+        ctx, response_data=json.dumps(status),
+        headers={"Content-Type": JSON_CONTENT_TYPE}
+    )
+
+
+def return_fn_error(ctx, fn_response, message, additional_data="None", status_code=500):
+    logging.critical(message)
+    # Return Error
+
+    return fn_response.Response(
+        ctx, response_data=json.dumps(
+            {
+                "errorMessage": message,
+                "additionalData": additional_data
+            }),
+        headers={"Content-Type": JSON_CONTENT_TYPE},
+        status_code=status_code
+    )
@@ -0,0 +1,256 @@
+# Copyright (c)  2021,  Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+#
+# Builds a job ledger of one million entries in memory, checks compaction, measures the Object Storage requests and
+# bytes of each compaction and measures lookup latency.
+# Runs locally, no OCI access required. Object Storage round trips (a manifest read, segment reads and a pending
+# listing per lookup) are not included in the latencies reported.
+#
+# usage : python3 benchmark_ledger.py [number of entries]
+#
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import job_ledger  # noqa: E402
+import sync_job_ledger  # noqa: E402
+
+SAMPLE_LOOKUPS = 1000
+STAGES = ((job_ledger.STAGE_TRANSFORMED, "Serverless_Integration_zip_inbound", ".zip"),
+          (job_ledger.STAGE_SUBMITTED, "Serverless_Integration_processing", ".zip_ERPJOBID_"),
+          (job_ledger.STAGE_SUCCEEDED, "Serverless_Integration_succeeded", ".zip_ERPJOBID_"))
+
+
+class CountingLedgerStore(job_ledger.MemoryLedgerStore):
+    """
+    Counts the Object Storage requests, and bytes transferred, the ledger would make
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.counts = {"get": 0, "put": 0, "delete": 0, "list": 0, "bytesRead": 0, "bytesWritten": 0}
+
+    def get(self, name):
+        content, etag = super().get(name)
+        self.counts["get"] += 1
+        self.counts["bytesRead"] += len(content or b"")
+        return content, etag
+
+    def put(self, name, content, if_match=None):
+        self.counts["put"] += 1
+        self.counts["bytesWritten"] += len(content)
+        super().put(name, content, if_match)
+
+    def delete(self, name):
+        self.counts["delete"] += 1
+        super().delete(name)
+
+    def list(self, prefix, limit=None):
+        self.counts["list"] += 1
+        return super().list(prefix, limit)
+
+
+def file_name(index):
+    return f'createInvoice.{index:08d}.json'
+
+
+def job_id(index):
+    return str(300000000 + index)
+
+
+def build_ledger(ledger, file_count):
+    # Files move through the pipeline one stage at a time, compacting after each stage
+    for stage, bucket, suffix in STAGES:
+        start = time.perf_counter()
+        for i in range(file_count):
+            erp_job_id = job_id(i) if stage != job_ledger.STAGE_TRANSFORMED else None
+            object_name = file_name(i).replace('.json', suffix) + (erp_job_id or "")
+            ledger.append(file_name(i), stage, bucket=bucket, object_name=object_name, erp_job_id=erp_job_id,
+                          content=object_name.encode())
+        appended = time.perf_counter() - start
+
+        start = time.perf_counter()
+        compacted = ledger.compact(max_entries=None, merge=True)
+        print(f'{stage:<12}: appended {file_count} entries in {appended:.1f}s, '
+              f'compacted {compacted} entries in {time.perf_counter() - start:.1f}s')
+        assert compacted == file_count
+        assert not ledger.store.list(job_ledger.PENDING_PREFIX)
+        assert not ledger.store.list(job_ledger.PENDING_JOB_PREFIX)
+
+
+def compact_during(ledger, method, prefix):
+    """
+    Compacts the ledger the first time the store method is called for an object name starting with prefix,
+    before the call is made
+    """
+    store = ledger.store
+    store_method = getattr(store, method)
+
+    def compact_first(name, *args, **kwargs):
+        if name.startswith(prefix):
+            setattr(store, method, store_method)
+            ledger.compact()
+        return store_method(name, *args, **kwargs)
+    setattr(store, method, compact_first)
+
+
+def check_compaction(ledger, file_count):
+    store = ledger.store
+    manifest, _ = ledger._read_manifest()
+    segments = [name for name in store.objects if name.startswith(job_ledger.FILE_SEGMENT_PREFIX)]
+    # Superseded segments are deleted, only the segments in the manifest remain
+    assert sorted(segments) == sorted(manifest["files"].values())
+    entry_count = sum(len(entries) for name in segments
+                      for entries in ledger._read_segment(name, cache=False).values())
+    assert entry_count == file_count * len(STAGES), entry_count
+    segment_bytes = sum(len(store.objects[name]) for name in store.objects if name.startswith("segments/"))
+    print(f'Segments    : {len(store.objects) - 1} objects, {segment_bytes / 1024 / 1024:.1f}MB for '
+          f'{entry_count} entries')
+
+    # A compaction which died before deleting its pending entries must not duplicate them when they are compacted again
+    ledger.append(file_name(0), job_ledger.STAGE_FAILED)
+    pending_names = store.list(job_ledger.PENDING_PREFIX)
+    pending = {name: store.objects[name] for name in pending_names}
+    ledger.compact(pending_names)
+    store.objects.update(pending)
+    ledger.compact()
+    stages = [e["stage"] for e in ledger.lookup_file(file_name(0))]
+    assert stages == [s[0] for s in STAGES] + [job_ledger.STAGE_FAILED], stages
+
+    # Two functions compacting at the same time, the second one to commit loses and cleans up its segments
+    ledger.append(file_name(1), job_ledger.STAGE_FAILED)
+    object_names = set(store.objects)
+    read_manifest = ledger._read_manifest
+    stale_manifest = read_manifest()
+    ledger._read_manifest = lambda: (dict(stale_manifest[0], files=dict(stale_manifest[0]["files"])),
+                                     "stale-etag")
+    try:
+        ledger.compact()
+        raise AssertionError("Compaction with a stale manifest should fail")
+    except job_ledger.LedgerConflictError:
+        pass
+    finally:
+        ledger._read_manifest = read_manifest
+    assert set(store.objects) == object_names
+    assert ledger.lookup_file(file_name(1))[-1]["stage"] == job_ledger.STAGE_FAILED
+    ledger.compact()
+
+    # A file uploaded twice under the same name is submitted as two jobs, each job only sees its own run
+    resubmitted = "createInvoice.resubmitted.json"
+    for erp_job_id in ("100", "200"):
+        ledger.append(resubmitted, job_ledger.STAGE_TRANSFORMED, object_name=resubmitted.replace('.json', '.zip'))
+        ledger.append(resubmitted, job_ledger.STAGE_SUBMITTED, erp_job_id=erp_job_id,
+                      object_name=resubmitted.replace('.json', '.zip_ERPJOBID_') + erp_job_id)
+    for compacted in (False, True):
+        if compacted:
+            ledger.compact()
+            assert not store.list(job_ledger.PENDING_JOB_PREFIX)
+        run = ledger.lookup_job("100")
+        assert [e["stage"] for e in run] == [job_ledger.STAGE_TRANSFORMED, job_ledger.STAGE_SUBMITTED], run
+        assert run[-1]["objectName"] == "createInvoice.resubmitted.zip_ERPJOBID_100", run
+        status = job_ledger.file_status(ledger.lookup_file(resubmitted))
+        assert status["erpJobId"] == "200" and len(status["history"]) == 2, status
+        assert [r["erpJobId"] for r in status["previousRuns"]] == ["100"], status
+
+    # A compaction which commits while a lookup is running must not hide entries from it
+    race_file = "createInvoice.race.json"
+    ledger.append(race_file, job_ledger.STAGE_TRANSFORMED)
+    ledger.append(race_file, job_ledger.STAGE_SUBMITTED, erp_job_id="300")
+    compact_during(ledger, "list", job_ledger.PENDING_PREFIX)
+    assert len(ledger.lookup_file(race_file)) == 2
+    ledger.append(race_file, job_ledger.STAGE_TRANSFORMED)
+    ledger.append(race_file, job_ledger.STAGE_SUBMITTED, erp_job_id="400")
+    compact_during(ledger, "get", job_ledger.PENDING_JOB_PREFIX)
+    assert len(ledger.lookup_job("400")) == 2
+
+    # A compaction only takes a bounded batch of pending entries, the rest are left for the next one
+    for i in range(5):
+        ledger.append(file_name(i), job_ledger.STAGE_FAILED)
+    assert ledger.compact(max_entries=3) == 3
+    assert ledger.compact_if_needed(threshold=3) == 0
+    assert ledger.compact_if_needed(threshold=2) == 2
+    assert store.get(job_ledger.COMPACTION_LOCK_NAME) == (None, None)
+    print("Compaction  : checks passed")
+
+
+def measure_compaction(ledger, file_count):
+    """
+    Compacts batches of new files the way erp-ledger-compact does, reporting the requests and bytes of the batches
+    written as delta segments and of the batch merging the deltas into the shard segments.
+    Leaves MAX_DELTA_SEGMENTS deltas in place so lookups are measured with the most segments to read.
+    """
+    store = ledger.store
+    index = file_count
+    delta_counts = []
+    merged = False
+    # Until a merge has been measured and the deltas have filled up again
+    while not merged or len(ledger._read_manifest()[0]["deltas"]) < job_ledger.MAX_DELTA_SEGMENTS:
+        merging = len(ledger._read_manifest()[0]["deltas"]) >= job_ledger.MAX_DELTA_SEGMENTS
+        merged = merged or merging
+        for _ in range(job_ledger.MAX_COMPACTION_BATCH):
+            ledger.append(file_name(index), job_ledger.STAGE_TRANSFORMED, content=file_name(index).encode())
+            index += 1
+        store.reset_counts()
+        start = time.perf_counter()
+        assert ledger.compact_if_needed() == job_ledger.MAX_COMPACTION_BATCH
+        elapsed = time.perf_counter() - start
+        if merging:
+            print_compaction("Merge batch", store.counts, elapsed)
+        else:
+            delta_counts.append((dict(store.counts), elapsed))
+    print_compaction("Delta batch (mean)", {key: sum(c[key] for c, _ in delta_counts) // len(delta_counts)
+                                           for key in delta_counts[0][0]},
+                     sum(e for _, e in delta_counts) / len(delta_counts))
+
+
+def print_compaction(label, counts, elapsed):
+    print(f'{label:<24}: {job_ledger.MAX_COMPACTION_BATCH} entries, {counts["get"]} GETs, {counts["put"]} PUTs, '
+          f'{counts["delete"]} DELETEs, {counts["list"]} LISTs, {counts["bytesRead"] / 1024 / 1024:.2f}MB read, '
+          f'{counts["bytesWritten"] / 1024 / 1024:.2f}MB written, {elapsed:.2f}s in memory')
+
+
+def measure(label, lookup, keys, cold):
+    timings = []
+    for key in keys:
+        if cold:
+            job_ledger._segment_cache.clear()
+        else:
+            # Repeated lookups of the same file, e.g. polling a status, are served from the segment cache
+            lookup(key)
+        start = time.perf_counter()
+        entries = lookup(key)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert entries, key
+    timings.sort()
+    print(f'{label:<24}: p50 {timings[len(timings) // 2]:.2f}ms, p99 {timings[int(len(timings) * 0.99)]:.2f}ms')
+
+
+def main():
+    differing = sync_job_ledger.differing_copies()
+    if differing:
+        print(f'job_ledger.py copies differ from erp-job-status, run sync_job_ledger.py : {differing}')
+        return 1
+
+    entry_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    file_count = entry_count // len(STAGES)
+    ledger = job_ledger.JobLedger(CountingLedgerStore())
+
+    build_ledger(ledger, file_count)
+    check_compaction(ledger, file_count)
+    measure_compaction(ledger, file_count)
+
+    sample = random.Random(42).sample(range(file_count), min(SAMPLE_LOOKUPS, file_count))
+    measure("Lookup by file (cold)", ledger.lookup_file, [file_name(i) for i in sample], cold=True)
+    measure("Lookup by file (warm)", ledger.lookup_file, [file_name(i) for i in sample], cold=False)
+    measure("Lookup by job id (cold)", ledger.lookup_job, [job_id(i) for i in sample], cold=True)
+    measure("Lookup by job id (warm)", ledger.lookup_job, [job_id(i) for i in sample], cold=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
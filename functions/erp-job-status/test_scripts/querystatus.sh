@@ -0,0 +1,13 @@
+# Copyright (c)  2021,  Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+# This script queries the status of a data file in the pipeline. Change the app name to suit your configuration
+#
+# usage : querystatus.sh <data file name>
+#         querystatus.sh -j <erp job id>
+set -x
+if [ "$1" == "-j" ]
+then
+    echo "{\"jobId\": \"$2\"}" | fn invoke Serverless_Integration erp-job-status
+else
+    echo "{\"file\": \"$1\"}" | fn invoke Serverless_Integration erp-job-status
+fi
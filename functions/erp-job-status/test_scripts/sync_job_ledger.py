@@ -0,0 +1,41 @@
+# Copyright (c)  2021,  Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+#
+# Each function is built from its own directory so job_ledger.py is copied into every function which uses it.
+# The copy in erp-job-status is the one to edit, this script copies it to the other functions, or with --check
+# lists the copies which differ from it and exits with 1.
+#
+# usage : python3 sync_job_ledger.py [--check]
+#
+import filecmp
+import os
+import shutil
+import sys
+
+FUNCTIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+SOURCE = os.path.join(FUNCTIONS_DIR, 'erp-job-status', 'job_ledger.py')
+
+
+def ledger_copies():
+    copies = (os.path.join(FUNCTIONS_DIR, name, 'job_ledger.py') for name in sorted(os.listdir(FUNCTIONS_DIR)))
+    return [copy for copy in copies if os.path.isfile(copy) and copy != SOURCE]
+
+
+def differing_copies():
+    return [copy for copy in ledger_copies() if not filecmp.cmp(SOURCE, copy, shallow=False)]
+
+
+def main():
+    differing = differing_copies()
+    if '--check' in sys.argv[1:]:
+        for copy in differing:
+            print(f'{os.path.relpath(copy, FUNCTIONS_DIR)} differs from {os.path.relpath(SOURCE, FUNCTIONS_DIR)}')
+        return 1 if differing else 0
+    for copy in differing:
+        shutil.copyfile(SOURCE, copy)
+        print(f'Updated {os.path.relpath(copy, FUNCTIONS_DIR)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+# Copyright (c) 2021, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+
+import logging
+import io
+import json
+from fdk import response
+import oci.object_storage
+import job_ledger
+
+JSON_CONTENT_TYPE = "application/json"
+
+
+def handler(ctx, data: io.BytesIO = None):
+    logging.info("------------------------------------------------------------------------------")
+    logging.info("Within erp-ledger-compact")
+    logging.info("------------------------------------------------------------------------------")
+
+    # Called by an event whenever a ledger entry is written, so compaction never runs in the pipeline functions
+    cfg = ctx.Config()
+    try:
+        param_ledger_bucket_name = cfg["ledger_bucket_name"]
+    except KeyError as ke:
+        message = f'Mandatory Configuration Parameter {ke} missing, please check all configuration parameters'
+        return return_fn_error(ctx, response, message)
+
+    signer = oci.auth.signers.get_resource_principals_signer()
+    object_storage_client = oci.object_storage.ObjectStorageClient(config={}, signer=signer)
+    namespace = object_storage_client.get_namespace().data
+    ledger = job_ledger.open_ledger(object_storage_client, namespace, param_ledger_bucket_name)
+
+    try:
+        compacted = ledger.compact_if_needed()
+    except job_ledger.LedgerConflictError as ex:
+        # Another compaction committed first, the entries are compacted by the next event
+        logging.info(f'Ledger compaction skipped, {ex.message}')
+        compacted = 0
+    except Exception as ex:
+        return return_fn_error(ctx, response, "Error compacting the job ledger", str(ex))
+
+    return response.Response(
+        ctx, response_data=json.dumps({"compactedEntries": compacted}),
+        headers={"Content-Type": JSON_CONTENT_TYPE}
+    )
+
+
+def return_fn_error(ctx, fn_response, message, additional_data="None"):
+    logging.critical(message)
+    # Return Error
+
+    return fn_response.Response(
+        ctx, response_data=json.dumps(
+            {
+                "errorMessage": message,
+                "additionalData": additional_data
+            }),
+        headers={"Content-Type": JSON_CONTENT_TYPE}
+    )
@@ -0,0 +1,521 @@
+# Copyright (c) 2021, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+#
+# Append only ledger recording where each data file is in the pipeline.
+#
+# Each function appends an entry as a small pending object, appends never contend with each other.
+# Pending entries are compacted, by the erp-ledger-compact function, into gzipped segments which are partitioned
+# (sharded) by a hash of the file name, with a second set of segments indexing ERP job id to file name. Until a job id
+# is compacted it is found through a small marker object named after the job id. A manifest object points to the
+# current segment of every shard, so a lookup is a manifest read, one (or two for a job id) segment reads and a
+# listing of the pending entries of a single shard, regardless of how many entries the ledger holds.
+#
+# Rewriting the shard segments costs in proportion to the size of the ledger, so each compaction writes its batch as a
+# single delta segment instead. Only once MAX_DELTA_SEGMENTS deltas have accumulated are they merged into the shard
+# segments, lookups also read the (small, cached) delta segments in the meantime.
+#
+# The same file name can go through the pipeline several times, each upload is a separate run of the file.
+#
+# This file is shared by all the functions. Edit the copy in erp-job-status then run
+# erp-job-status/test_scripts/sync_job_ledger.py to copy it to the other functions.
+
+
+import gzip
+import hashlib
+import json
+import logging
+import re
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+from oci.exceptions import ServiceError
+
+SHARD_COUNT = 256
+COMPACTION_THRESHOLD = 50
+# Bounds the work, one GET per entry, done by a single compaction so it completes within the function timeout
+MAX_COMPACTION_BATCH = 500
+COMPACTION_LOCK_TIMEOUT_MS = 300 * 1000
+MAX_DELTA_SEGMENTS = 8
+# Room for the delta segments as well as the shard segments of recently looked up files
+SEGMENT_CACHE_SIZE = 32
+
+MANIFEST_NAME = "manifest.json"
+PENDING_PREFIX = "pending/"
+PENDING_JOB_PREFIX = "pending-jobs/"
+COMPACTION_LOCK_NAME = "compaction.lock"
+FILE_SEGMENT_PREFIX = "segments/files/"
+JOB_SEGMENT_PREFIX = "segments/jobs/"
+DELTA_SEGMENT_PREFIX = "segments/deltas/"
+
+STAGE_TRANSFORMED = "TRANSFORMED"
+STAGE_REJECTED = "REJECTED"
+STAGE_SUBMITTED = "SUBMITTED"
+STAGE_SUCCEEDED = "SUCCEEDED"
+STAGE_FAILED = "FAILED"
+# Stages which start a new run of a file
+RUN_START_STAGES = (STAGE_TRANSFORMED, STAGE_REJECTED)
+
+# Entries are stored as lists in this order, the file name and shard are implied by where the entry is stored
+STORED_FIELDS = ("id", "contentHash", "erpJobId", "stage", "bucket", "objectName", "timestamp")
+FILE_SUFFIX_REGEX = re.compile(r'(\.json|\.zip)?(_ERPJOBID_.*)?$')
+
+# Segments are immutable once written so they can be cached for the life of the function container
+_segment_cache = {}
+
+
+class LedgerConflictError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+class ObjectStorageLedgerStore:
+    """
+    Stores ledger objects in an OCI Object Storage bucket
+    """
+
+    def __init__(self, object_storage_client, namespace, bucket_name):
+        self.client = object_storage_client
+        self.namespace = namespace
+        self.bucket_name = bucket_name
+
+    def get(self, name):
+        """
+        Returns (content, etag), or (None, None) if the object does not exist
+        """
+        try:
+            result = self.client.get_object(self.namespace, self.bucket_name, name)
+        except ServiceError as ex:
+            if ex.status == 404:
+                return None, None
+            raise
+        return result.data.content, result.headers.get('etag')
+
+    def put(self, name, content, if_match=None):
+        """
+        Writes an object, if_match is an etag or "*" for an object which must not already exist
+        """
+        kwargs = {}
+        if if_match == "*":
+            kwargs["if_none_match"] = "*"
+        elif if_match is not None:
+            kwargs["if_match"] = if_match
+        try:
+            self.client.put_object(self.namespace, self.bucket_name, name, content, **kwargs)
+        except ServiceError as ex:
+            if ex.status in (409, 412):
+                raise LedgerConflictError(f'Ledger object {name} was modified by another function')
+            raise
+
+    def delete(self, name):
+        try:
+            self.client.delete_object(self.namespace, self.bucket_name, name)
+        except ServiceError as ex:
+            if ex.status != 404:
+                raise
+
+    def list(self, prefix, limit=None):
+        names = []
+        start = None
+        while True:
+            kwargs = {"limit": min(1000, limit - len(names))} if limit is not None else {}
+            result = self.client.list_objects(self.namespace, self.bucket_name, prefix=prefix, start=start, **kwargs)
+            names.extend(o.name for o in result.data.objects)
+            start = result.data.next_start_with
+            if not start or (limit is not None and len(names) >= limit):
+                return names
+
+
+class MemoryLedgerStore:
+    """
+    In memory store with the same semantics as ObjectStorageLedgerStore, used to run the ledger locally
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def get(self, name):
+        content = self.objects.get(name)
+        if content is None:
+            return None, None
+        return content, str(zlib.crc32(content))
+
+    def put(self, name, content, if_match=None):
+        if if_match is not None:
+            _, etag = self.get(name)
+            if (if_match == "*" and etag is not None) or (if_match != "*" and etag != if_match):
+                raise LedgerConflictError(f'Ledger object {name} was modified by another function')
+        self.objects[name] = content if isinstance(content, bytes) else content.encode()
+
+    def delete(self, name):
+        self.objects.pop(name, None)
+
+    def list(self, prefix, limit=None):
+        return sorted(name for name in self.objects if name.startswith(prefix))[:limit]
+
+
+def ledger_file_key(file_name):
+    """
+    The ledger tracks a data file under its name without extension or ERP job suffix, so createInvoice.json,
+    createInvoice.zip and createInvoice.zip_ERPJOBID_1234 are the same file
+    """
+    return FILE_SUFFIX_REGEX.sub('', file_name, count=1)
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def shard_of(key):
+    return zlib.crc32(key.encode()) % SHARD_COUNT
+
+
+def _pending_shard_prefix(shard):
+    return f'{PENDING_PREFIX}{shard:03d}/'
+
+
+def _pending_name(shard, entry_id):
+    return f'{_pending_shard_prefix(shard)}{entry_id}.json'
+
+
+def _pending_job_name(erp_job_id):
+    return f'{PENDING_JOB_PREFIX}{erp_job_id}.json'
+
+
+def _to_entry(file_key, shard, stored):
+    entry = dict(zip(STORED_FIELDS, stored))
+    entry["file"] = file_key
+    entry["shard"] = shard
+    entry["timestamp"] = datetime.fromtimestamp(entry["timestamp"] / 1000, tz=timezone.utc).isoformat()
+    return entry
+
+
+class JobLedger:
+
+    def __init__(self, store):
+        self.store = store
+
+    #
+    # Writing
+    #
+    def append(self, file_name, stage, bucket=None, object_name=None, erp_job_id=None, content=None):
+        """
+        Appends an entry for file_name, content is the data file content at this stage and is stored as a hash
+        """
+        file_key = ledger_file_key(file_name)
+        shard = shard_of(file_key)
+        # Ids sort in the order entries were written, nanoseconds so steps a file goes through in quick succession
+        # keep their order
+        timestamp_ns = time.time_ns()
+        timestamp = timestamp_ns // 1000000
+        entry_id = f'{timestamp_ns:019d}{uuid.uuid4().hex[:12]}'
+        stored = [entry_id, content_hash(content) if content is not None else None,
+                  erp_job_id, stage, bucket, object_name, timestamp]
+        if erp_job_id:
+            # Lets the job be found with a single read until it is compacted into the job index
+            self.store.put(_pending_job_name(erp_job_id), json.dumps(file_key).encode())
+        self.store.put(_pending_name(shard, entry_id), json.dumps([file_key, stored]).encode())
+        return _to_entry(file_key, shard, stored)
+
+    def compact_if_needed(self, threshold=COMPACTION_THRESHOLD):
+        """
+        Compacts at most MAX_COMPACTION_BATCH pending entries if there are at least threshold of them and no other
+        function is compacting. Returns the number of entries compacted.
+        """
+        pending_names = self.store.list(PENDING_PREFIX, limit=MAX_COMPACTION_BATCH)
+        if len(pending_names) < threshold or not self._acquire_compaction_lock():
+            return 0
+        try:
+            return self.compact(pending_names)
+        finally:
+            self.store.delete(COMPACTION_LOCK_NAME)
+
+    def compact(self, pending_names=None, max_entries=MAX_COMPACTION_BATCH, merge=False):
+        """
+        Writes pending entries to a delta segment, or merges them and the delta segments into the shard segments
+        when there are MAX_DELTA_SEGMENTS deltas or merge is True. Returns the number of entries compacted.
+        Raises LedgerConflictError if another function compacted the ledger at the same time, in which case the
+        pending entries are left for the next compaction.
+        """
+        if pending_names is None:
+            pending_names = self.store.list(PENDING_PREFIX, limit=max_entries)
+        if not pending_names:
+            return 0
+
+        manifest, manifest_etag = self._read_manifest()
+        generation = manifest["generation"] + 1
+        suffix = f'{generation:010d}_{uuid.uuid4().hex[:8]}.json.gz'
+        deltas = manifest.get("deltas", [])
+
+        delta = {"files": {}, "jobs": {}}
+        for name in pending_names:
+            content, _ = self.store.get(name)
+            if content is None:
+                continue
+            file_key, stored = json.loads(content)
+            delta["files"].setdefault(file_key, []).append(stored)
+            erp_job_id = stored[2]
+            if erp_job_id:
+                delta["jobs"][erp_job_id] = file_key
+
+        written = []
+        superseded = []
+        try:
+            if merge or len(deltas) >= MAX_DELTA_SEGMENTS:
+                superseded = self._merge(manifest, deltas + [delta], suffix, written)
+                manifest["deltas"] = []
+            else:
+                segment_name = f'{DELTA_SEGMENT_PREFIX}{suffix}'
+                self._write_segment(segment_name, delta)
+                written.append(segment_name)
+                manifest["deltas"] = deltas + [segment_name]
+
+            manifest["generation"] = generation
+            self.store.put(MANIFEST_NAME, json.dumps(manifest).encode(), if_match=manifest_etag or "*")
+        except LedgerConflictError:
+            for name in written:
+                self.store.delete(name)
+            raise
+
+        # Job markers are only deleted once the job is in the committed job index
+        job_markers = [_pending_job_name(erp_job_id) for erp_job_id in delta["jobs"]]
+        for name in superseded + job_markers + pending_names:
+            self.store.delete(name)
+        logging.info(f'Compacted {len(pending_names)} ledger entries into generation {generation}')
+        return len(pending_names)
+
+    def _merge(self, manifest, deltas, suffix, written):
+        """
+        Merges deltas, segment names or segments, into new shard segments referenced from manifest.
+        Returns the names of the segments superseded.
+        """
+        # Group the delta entries by file shard and job shard
+        file_shards = {}
+        job_shards = {}
+        superseded = []
+        for delta in deltas:
+            if isinstance(delta, str):
+                superseded.append(delta)
+                delta = self._read_segment(delta, cache=False)
+                if not delta:
+                    # Deleted by a compaction which merged it after the manifest was read
+                    raise LedgerConflictError(f'Ledger delta segment {superseded[-1]} was merged by another function')
+            for file_key, stored_entries in delta["files"].items():
+                file_shards.setdefault(shard_of(file_key), []).extend((file_key, stored) for stored in stored_entries)
+            for erp_job_id, file_key in delta["jobs"].items():
+                job_shards.setdefault(shard_of(erp_job_id), {})[erp_job_id] = file_key
+
+        # Shards are merged one at a time to bound memory use
+        for shard, new_entries in file_shards.items():
+            current_name = manifest["files"].get(str(shard))
+            files = self._read_segment(current_name, cache=False)
+            for file_key, stored in new_entries:
+                entries = files.setdefault(file_key, [])
+                # Entries compacted more than once, when a compaction died before deleting them, are skipped
+                if not any(e[0] == stored[0] for e in entries):
+                    entries.append(stored)
+                    entries.sort(key=lambda e: e[0])
+            segment_name = f'{FILE_SEGMENT_PREFIX}{shard:03d}/{suffix}'
+            self._write_segment(segment_name, files)
+            written.append(segment_name)
+            manifest["files"][str(shard)] = segment_name
+            if current_name:
+                superseded.append(current_name)
+
+        for shard, new_jobs in job_shards.items():
+            current_name = manifest["jobs"].get(str(shard))
+            jobs = self._read_segment(current_name, cache=False)
+            jobs.update(new_jobs)
+            segment_name = f'{JOB_SEGMENT_PREFIX}{shard:03d}/{suffix}'
+            self._write_segment(segment_name, jobs)
+            written.append(segment_name)
+            manifest["jobs"][str(shard)] = segment_name
+            if current_name:
+                superseded.append(current_name)
+        return superseded
+
+    #
+    # Reading
+    #
+    def lookup_file(self, file_name):
+        """
+        Returns all entries for a data file, oldest first
+        """
+        file_key = ledger_file_key(file_name)
+        shard = shard_of(file_key)
+        # Pending entries are read before the manifest. Compaction commits the manifest before deleting the pending
+        # entries, so an entry which is gone from the pending listing is in the manifest read afterwards
+        stored_entries = []
+        for name in self.store.list(_pending_shard_prefix(shard)):
+            content, _ = self.store.get(name)
+            if content is None:
+                continue
+            pending_file_key, stored = json.loads(content)
+            if pending_file_key == file_key:
+                stored_entries.append(stored)
+
+        for attempt in range(2):
+            manifest, _ = self._read_manifest()
+            try:
+                segment_entries = list(self._read_segment(manifest["files"].get(str(shard)), required=True)
+                                       .get(file_key, []))
+                for delta_name in manifest.get("deltas", []):
+                    segment_entries.extend(self._read_segment(delta_name, required=True)["files"].get(file_key, []))
+                break
+            except KeyError:
+                # Segment replaced by a compaction after the manifest was read, read the new manifest
+                if attempt:
+                    raise
+
+        # An entry can be both pending and compacted while a compaction is deleting its pending entries, or be in
+        # two deltas if a compaction died before deleting them
+        seen = {e[0] for e in stored_entries}
+        for stored in segment_entries:
+            if stored[0] not in seen:
+                seen.add(stored[0])
+                stored_entries.append(stored)
+        stored_entries.sort(key=lambda e: e[0])
+        return [_to_entry(file_key, shard, stored) for stored in stored_entries]
+
+    def lookup_job(self, erp_job_id):
+        """
+        Returns the entries of the run of the data file which was submitted as ERP job erp_job_id, oldest first
+        """
+        erp_job_id = str(erp_job_id)
+        manifest, manifest_etag = self._read_manifest()
+        file_key = self._find_job(manifest, erp_job_id)
+        if file_key is None:
+            # Not compacted yet
+            content, _ = self.store.get(_pending_job_name(erp_job_id))
+            if content is not None:
+                file_key = json.loads(content)
+            else:
+                # The marker is only deleted once a compaction has committed the job, read the manifest it committed
+                manifest, etag = self._read_manifest()
+                if etag != manifest_etag:
+                    file_key = self._find_job(manifest, erp_job_id)
+        if file_key is None:
+            return []
+        return next((run for run in split_runs(self.lookup_file(file_key))
+                     if any(e["erpJobId"] == erp_job_id for e in run)), [])
+
+    def _find_job(self, manifest, erp_job_id):
+        try:
+            for delta_name in reversed(manifest.get("deltas", [])):
+                file_key = self._read_segment(delta_name, required=True)["jobs"].get(erp_job_id)
+                if file_key is not None:
+                    return file_key
+            return self._read_segment(manifest["jobs"].get(str(shard_of(erp_job_id))), required=True).get(erp_job_id)
+        except KeyError:
+            # Segment replaced by a compaction after the manifest was read
+            return None
+
+    def _acquire_compaction_lock(self):
+        content, etag = self.store.get(COMPACTION_LOCK_NAME)
+        now = int(time.time() * 1000)
+        # A lock older than the timeout was left by a compaction which died, it can be taken over
+        if content is not None and now - json.loads(content)["acquired"] < COMPACTION_LOCK_TIMEOUT_MS:
+            return False
+        try:
+            self.store.put(COMPACTION_LOCK_NAME, json.dumps({"acquired": now}).encode(), if_match=etag or "*")
+        except LedgerConflictError:
+            return False
+        return True
+
+    def _read_manifest(self):
+        content, etag = self.store.get(MANIFEST_NAME)
+        if content is None:
+            return {"generation": 0, "files": {}, "jobs": {}, "deltas": []}, None
+        return json.loads(content), etag
+
+    def _read_segment(self, name, required=False, cache=True):
+        if name is None:
+            return {}
+        # Compaction modifies the segments it reads so they are never taken from, or added to, the cache
+        segment = _segment_cache.get(name) if cache else None
+        if segment is None:
+            content, _ = self.store.get(name)
+            if content is None:
+                if required:
+                    raise KeyError(name)
+                return {}
+            segment = json.loads(gzip.decompress(content))
+            if not cache:
+                return segment
+            if len(_segment_cache) >= SEGMENT_CACHE_SIZE:
+                _segment_cache.pop(next(iter(_segment_cache)))
+            _segment_cache[name] = segment
+        return segment
+
+    def _write_segment(self, name, segment):
+        self.store.put(name, gzip.compress(json.dumps(segment, separators=(',', ':')).encode()))
+
+
+def split_runs(entries):
+    """
+    Splits the entries of a file into runs, one per upload of the file, oldest first.
+    A run starts with a TRANSFORMED or REJECTED entry, later entries belong to the run holding the same ERP job id,
+    or else to the latest transformed run which has not been submitted to ERP yet.
+    """
+    runs = []
+    for entry in entries:
+        run = None
+        if entry["stage"] not in RUN_START_STAGES:
+            erp_job_id = entry["erpJobId"]
+            if erp_job_id:
+                run = next((r for r in reversed(runs) if any(e["erpJobId"] == erp_job_id for e in r)), None)
+            if run is None:
+                run = next((r for r in reversed(runs) if r[0]["stage"] == STAGE_TRANSFORMED and
+                            not any(e["erpJobId"] for e in r)), None)
+        if run is None:
+            runs.append([entry])
+        else:
+            run.append(entry)
+    return runs
+
+
+def _run_status(run):
+    latest = run[-1]
+    return {
+        "file": latest["file"],
+        "stage": latest["stage"],
+        "bucket": latest["bucket"],
+        "objectName": latest["objectName"],
+        "erpJobId": next((e["erpJobId"] for e in reversed(run) if e["erpJobId"]), None),
+        "started": run[0]["timestamp"],
+        "updated": latest["timestamp"]
+    }
+
+
+def file_status(entries, erp_job_id=None):
+    """
+    Summarises the entries of a data file into its current position in the pipeline.
+    The summary and history are those of the run submitted as erp_job_id, or of the latest run, with a summary of
+    the other runs of the same file name.
+    """
+    runs = split_runs(entries)
+    if erp_job_id is not None:
+        runs = [run for run in runs if any(e["erpJobId"] == erp_job_id for e in run)]
+    if not runs:
+        return None
+    status = _run_status(runs[-1])
+    status["history"] = [{"stage": e["stage"], "timestamp": e["timestamp"], "contentHash": e["contentHash"],
+                          "erpJobId": e["erpJobId"], "objectName": e["objectName"]} for e in runs[-1]]
+    status["previousRuns"] = [_run_status(run) for run in runs[:-1]]
+    return status
+
+
+def append_safely(ledger, file_name, stage, **kwargs):
+    """
+    The ledger is informational, failing to write it must never stop a file being processed
+    """
+    try:
+        return ledger.append(file_name, stage, **kwargs)
+    except Exception as ex:
+        logging.warning(f'Unable to record {stage} of {file_name} in the job ledger {ex}')
+        return None
+
+
+def open_ledger(object_storage_client, namespace, ledger_bucket_name):
+    return JobLedger(ObjectStorageLedgerStore(object_storage_client, namespace, ledger_bucket_name))
@@ -5,59 +5,241 @@
 import zipfile
 import io
 import logging
+import os
+import re
+from datetime import date
+from functools import lru_cache
+
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+PLACEHOLDER_REGEX = re.compile(r'\$([A-Z]+)')
+# [0-9] rather than \d, which also matches non ASCII digits such as full width digits that ERP does not accept
+DATE_REGEX = re.compile(r'([0-9]{4})/([0-9]{2})/([0-9]{2})')
+NUMBER_REGEX = re.compile(r'-?[0-9]+(\.[0-9]+)?')
+CSV_SPECIAL_CHARS_REGEX = re.compile(r'[,"\r\n]')
+
+# Invoice schema, keys are the (upper case) $NAME placeholders used in the CSV templates
+INVOICE_LINES_KEY = "INVOICELINES"
+INVOICE_LINES_JSON_KEY = "invoiceLines"
+INVOICE_REQUIRED_FIELDS = ("INVOICEID", "ACCOUNTINGDATE")
+INVOICE_LINE_REQUIRED_FIELDS = ("AMOUNT",)
+# Fields which are filled in by this module rather than taken from the invoice line
+INVOICE_LINE_INHERITED_FIELDS = ("INVOICEID", "ACCOUNTINGDATE", "INVOICELINENUM")
+# bool is deliberately excluded, it would be rendered as True/False
+NUMBER_TYPES = (int, float)
+
+
+@lru_cache(maxsize=4096)
+def _is_date(text):
+    # The regex enforces the zero padded ERP format, date() checks the date exists.
+    # Cached as the invoices of a file usually share a handful of dates
+    match = DATE_REGEX.fullmatch(text)
+    if match is None:
+        return False
+    try:
+        date(*map(int, match.groups()))
+    except ValueError:
+        return False
+    return True
+
+
+# Format checks applied to individual fields, as (check, expected format)
+FIELD_FORMATS = {
+    "INVOICEDATE": (_is_date, "a valid date in YYYY/MM/DD format"),
+    "TERMSDATE": (_is_date, "a valid date in YYYY/MM/DD format"),
+    "ACCOUNTINGDATE": (_is_date, "a valid date in YYYY/MM/DD format"),
+    "INVOICEAMOUNT": (NUMBER_REGEX.fullmatch, "a numeric value"),
+    "AMOUNT": (NUMBER_REGEX.fullmatch, "a numeric value"),
+}
+
+
+class InvoiceValidationError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+class _TemplateValues(dict):
+    # Placeholders with no value in the invoice are rendered as empty CSV columns
+    def __missing__(self, key):
+        return ""
+
+
+def compile_template(template_file_name):
+    """
+    Reads a $NAME style CSV template and converts it into a format string, so each row is rendered in a single
+    call rather than one string replace per field.
+    """
+    with open(os.path.join(TEMPLATE_DIR, template_file_name), 'r') as f:
+        template = f.read()
+    fields = frozenset(PLACEHOLDER_REGEX.findall(template))
+    format_string = PLACEHOLDER_REGEX.sub(r'{\1}', template.replace('{', '{{').replace('}', '}}'))
+    return format_string, fields
+
+
+# Templates are compiled once when the function container starts, not once per file
+INVOICE_TEMPLATE, INVOICE_FIELDS = compile_template('APInvoiceTemplate.csv.template')
+INVOICE_LINE_TEMPLATE, INVOICE_LINE_FIELDS = compile_template('APInvoiceLinesTemplate.csv.template')
+INVOICE_LINE_INPUT_FIELDS = INVOICE_LINE_FIELDS.difference(INVOICE_LINE_INHERITED_FIELDS)
+# Validator for each record type, as (template fields, fields with no format check, mandatory fields)
+INVOICE_SCHEMA = (INVOICE_FIELDS, INVOICE_FIELDS.difference(FIELD_FORMATS), INVOICE_REQUIRED_FIELDS)
+INVOICE_LINE_SCHEMA = (INVOICE_LINE_INPUT_FIELDS, INVOICE_LINE_INPUT_FIELDS.difference(FIELD_FORMATS),
+                       INVOICE_LINE_REQUIRED_FIELDS)
+
+
+def csv_escape(value):
+    value = f'{value}'
+    if CSV_SPECIAL_CHARS_REGEX.search(value):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _check_value(field, key, value, path, errors):
+    """
+    Validates and CSV escapes a single field value in one step.
+    Returns the escaped value, or None if the value is invalid in which case the error is added to errors.
+    null is rendered as an empty column, mandatory fields are then reported as missing by _collect_fields.
+    """
+    value_type = type(value)
+    if value_type is str:
+        text = value
+    elif value is None:
+        return ""
+    elif value_type in NUMBER_TYPES:
+        text = f'{value}'
+    else:
+        errors.append({"path": f'{path}.{key}',
+                       "message": f'Expected a string or number, got {value_type.__name__}'})
+        return None
+    field_format = FIELD_FORMATS.get(field)
+    if field_format is not None:
+        # Dates and numbers never need CSV escaping
+        if field_format[0](text):
+            return text
+        errors.append({"path": f'{path}.{key}', "message": f'Expected {field_format[1]}, got "{text}"'})
+        return None
+    if CSV_SPECIAL_CHARS_REGEX.search(text):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def _collect_fields(record, path, schema, errors):
+    """
+    Validates a single invoice or invoice line and returns its CSV escaped values keyed by template placeholder.
+    Keys are matched case insensitively, keys not used by the template are ignored.
+    """
+    values = _TemplateValues()
+    template_fields, plain_fields, required_fields = schema
+    search_special_chars = CSV_SPECIAL_CHARS_REGEX.search
+    for key, value in record.items():
+        field = key.upper()
+        # Fast path for the common case of a plain string with no format to check
+        if field in plain_fields and type(value) is str and not search_special_chars(value):
+            values[field] = value
+        elif field in template_fields:
+            # Invalid values are stored as None so they are not reported again as missing
+            values[field] = _check_value(field, key, value, path, errors)
+    for field in required_fields:
+        value = values[field]
+        if value is not None and not value.strip():
+            errors.append({"path": path, "message": f'Mandatory field {field} is missing or empty'})
+    return values
+
+
+def transform_invoice(invoice):
+    """
+    Validates and renders a single invoice in one pass.
+    Returns the rendered invoice row, the rendered invoice line rows and a list of errors, each with a JSON path
+    relative to the invoice, e.g. ".invoiceLines[0].amount". Paths are only built when there is an error.
+    If errors is not empty the rendered rows must not be used.
+    """
+    errors = []
+    if not isinstance(invoice, dict):
+        errors.append({"path": "", "message": f'Expected an invoice object, got {type(invoice).__name__}'})
+        return "", "", errors
+
+    invoice_values = _collect_fields(invoice, "", INVOICE_SCHEMA, errors)
+
+    # Keys are matched case insensitively, only scan for the key when it is not in the documented case
+    lines_key = INVOICE_LINES_JSON_KEY
+    invoice_lines = invoice.get(lines_key)
+    if invoice_lines is None:
+        lines_key = next((key for key in invoice if key.upper() == INVOICE_LINES_KEY), lines_key)
+        invoice_lines = invoice.get(lines_key, [])
+    if not isinstance(invoice_lines, list):
+        errors.append({"path": f'.{lines_key}', "message": "Expected a list of invoice lines"})
+        invoice_lines = []
+
+    rendered_lines = []
+    for line_number, invoice_line in enumerate(invoice_lines, start=1):
+        error_count = len(errors)
+        if not isinstance(invoice_line, dict):
+            errors.append({"path": "",
+                           "message": f'Expected an invoice line object, got {type(invoice_line).__name__}'})
+        else:
+            line_values = _collect_fields(invoice_line, "", INVOICE_LINE_SCHEMA, errors)
+            # Set Linenumber, Invoice ID, $ACCOUNTINGDATE from the parent invoice
+            line_values["INVOICELINENUM"] = str(line_number)
+            line_values["INVOICEID"] = invoice_values["INVOICEID"]
+            line_values["ACCOUNTINGDATE"] = invoice_values["ACCOUNTINGDATE"]
+            rendered_lines.append(INVOICE_LINE_TEMPLATE.format_map(line_values))
+        for error in errors[error_count:]:
+            error["path"] = f'.{lines_key}[{line_number - 1}]{error["path"]}'
+
+    if errors:
+        return "", "", errors
+    return INVOICE_TEMPLATE.format_map(invoice_values), "".join(rendered_lines), errors
 
 
 def create_erp_invoices_datafiles(json_data, zip_file_name):
+    """
+    Validates and transforms the invoices in json_data, writing the ERP zip file to zip_file_name.
+    Invalid invoices are skipped rather than failing the whole batch.
+    Returns a tuple of (number of invoices written to the zip file, list of rejected invoices with their errors).
+    Raises InvoiceValidationError if the file does not contain a non empty invoices list.
+    """
     logging.info("Within create_erp_invoices_datafiles function")
-    invoice_template = open('APInvoiceTemplate.csv.template', 'r').read()
-    invoice_line_template = open('APInvoiceLinesTemplate.csv.template', 'r').read()
+
+    if not isinstance(json_data, dict) or not isinstance(json_data.get('invoices'), list):
+        raise InvoiceValidationError("Data file must be a JSON object containing an invoices list")
+    if not json_data['invoices']:
+        raise InvoiceValidationError("Data file does not contain any invoices")
 
     # Now process the file
-    ap_invoices_interface = ""
-    ap_invoice_lines_interface = ""
-
-    for single_invoice in json_data['invoices']:
-        new_invoice = invoice_template
-        for invoice_key, invoice_key_value in single_invoice.items():
-            if invoice_key.upper() == "INVOICELINES":
-                # Process Invoice Lines
-                line_number = 1  # Set line number 1 and increment for each invoiceline
-                for invoice_line in invoice_key_value:
-                    # Process MANDATORY Elements in Invoice Line
-                    # Get new template object
-                    new_invoice_line = invoice_line_template
-                    # Set Linenumber,  Invoice ID, $ACCOUNTINGDATE
-                    new_invoice_line = new_invoice_line.replace("$INVOICELINENUM", str(line_number))
-                    line_number = line_number + 1
-                    new_invoice_line = new_invoice_line.replace("$ACCOUNTINGDATE", single_invoice['accountingDate'])
-                    new_invoice_line = new_invoice_line.replace("$INVOICEID", single_invoice['invoiceId'])
-
-                    # Now process invoice lines
-                    for invoice_lines_key, invoice_lines_value in invoice_line.items():
-                        new_invoice_line = new_invoice_line.replace(f'${invoice_lines_key.upper()}',
-                                                                    f'{invoice_lines_value}')
-                    ap_invoice_lines_interface = ap_invoice_lines_interface + new_invoice_line
-            else:
-                # Process Invoices
-                new_invoice = new_invoice.replace(f'${invoice_key.upper()}', f'{invoice_key_value}')
-        ap_invoices_interface = ap_invoices_interface + new_invoice
-
-        logging.info("Processed data")
-        logging.info("AP_INVOICES_INTERFACE")
-        logging.info(ap_invoices_interface)
-        logging.info("AP_INVOICE_LINES_INTERFACE")
-        logging.info(ap_invoice_lines_interface)
-
-        # Write data to zip file.
-        # Due to limits of disk space in Functions, the zip file is created on the fly.
-        zip_buffer = io.BytesIO()
-        destination_zip_name = f'{zip_file_name}'
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED, False) as zip_file:
-            for file_name, json_data in [('ApInvoicesInterface.csv', io.BytesIO(ap_invoices_interface.encode())),
-                                         ('ApInvoiceLinesInterface.csv', io.BytesIO(ap_invoice_lines_interface.encode()))]:
-                zip_file.writestr(file_name, json_data.getvalue())
-
-        with open(destination_zip_name, 'wb') as f:
-            f.write(zip_buffer.getvalue())
-
-    logging.info(f'Zip file writen to {destination_zip_name}')
\ No newline at end of file
+    ap_invoices_interface = []
+    ap_invoice_lines_interface = []
+    rejected_invoices = []
+
+    for index, single_invoice in enumerate(json_data['invoices']):
+        new_invoice, new_invoice_lines, errors = transform_invoice(single_invoice)
+        if errors:
+            invoice_path = f'$.invoices[{index}]'
+            for error in errors:
+                error["path"] = invoice_path + error["path"]
+            logging.info(f'Rejecting invoice {invoice_path} : {errors}')
+            rejected_invoices.append({"path": invoice_path, "invoice": single_invoice, "errors": errors})
+        else:
+            ap_invoices_interface.append(new_invoice)
+            ap_invoice_lines_interface.append(new_invoice_lines)
+
+    ap_invoices_interface = "".join(ap_invoices_interface)
+    ap_invoice_lines_interface = "".join(ap_invoice_lines_interface)
+
+    logging.info("Processed data")
+    logging.debug("AP_INVOICES_INTERFACE")
+    logging.debug(ap_invoices_interface)
+    logging.debug("AP_INVOICE_LINES_INTERFACE")
+    logging.debug(ap_invoice_lines_interface)
+
+    # Write data to zip file.
+    # Due to limits of disk space in Functions, the zip file is created on the fly.
+    zip_buffer = io.BytesIO()
+    destination_zip_name = f'{zip_file_name}'
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED, False) as zip_file:
+        for file_name, csv_data in [('ApInvoicesInterface.csv', ap_invoices_interface),
+                                    ('ApInvoiceLinesInterface.csv', ap_invoice_lines_interface)]:
+            zip_file.writestr(file_name, csv_data.encode())
+
+    with open(destination_zip_name, 'wb') as f:
+        f.write(zip_buffer.getvalue())
+
+    logging.info(f'Zip file writen to {destination_zip_name}')
+    return len(json_data['invoices']) - len(rejected_invoices), rejected_invoices
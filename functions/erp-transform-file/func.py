@@ -9,6 +9,7 @@ import json
 import oci.object_storage
 from fdk import response
 import erp_data_file
+import job_ledger
 
 
 def handler(ctx, data: io.BytesIO = None):
@@ -26,6 +27,8 @@ def handler(ctx, data: io.BytesIO = None):
     try:
         param_json_inbound_bucket_name = cfg['json_inbound_bucket_name']
         param_zip_inbound_bucket_name = cfg["zip_inbound_bucket_name"]
+        param_failed_bucket_name = cfg["failed_bucket_name"]
+        param_ledger_bucket_name = cfg["ledger_bucket_name"]
 
         param_ons_error_topic_ocid = cfg["ons_error_topic_ocid"]
         param_ons_info_topic_ocid = cfg["ons_info_topic_ocid"]
@@ -88,26 +91,80 @@ def handler(ctx, data: io.BytesIO = None):
                                     additional_details=additional_details
                                     )
         return return_fn_error(ctx, response, message)
-    # Write result to /tmp
+    # Validate and write result to /tmp
     transformed_data_file = "/tmp/ " + json_datafile_name
-    erp_data_file.create_erp_invoices_datafiles(json_data, transformed_data_file)
+    try:
+        valid_invoice_count, rejected_invoices = erp_data_file.create_erp_invoices_datafiles(json_data,
+                                                                                            transformed_data_file)
+    except erp_data_file.InvoiceValidationError as ex:
+        additional_details = {"validationError": ex.message,
+                              "filename": json_datafile_name
+                              }
+        message = send_notification(ons_topic_id=param_ons_error_topic_ocid,
+                                    title="Invoice Validation Exception",
+                                    message="Invalid invoice data file, please check the file",
+                                    status="ERROR",
+                                    additional_details=additional_details
+                                    )
+        return return_fn_error(ctx, response, message)
 
-    # Write resulting object to json_inbound_bucket_name, no change extension , enroute
-    with open(transformed_data_file, 'rb') as f:
-        oci_response = object_storage_client.put_object(namespace, param_zip_inbound_bucket_name,
-                                                        json_datafile_name.replace('.json', '.zip'), f)
+    # Invalid invoices are written to a reject file in the failed bucket, the rest of the batch carries on
+    if rejected_invoices:
+        reject_file_name = json_datafile_name.replace('.json', '.rejected.json')
+        oci_response = object_storage_client.put_object(namespace, param_failed_bucket_name, reject_file_name,
+                                                        json.dumps({"rejectedInvoices": rejected_invoices}))
+        additional_details = {"jsonDataFilename": json_datafile_name,
+                              "rejectFilename": reject_file_name,
+                              "rejectedInvoiceCount": len(rejected_invoices),
+                              "validInvoiceCount": valid_invoice_count}
         if oci_response.status != 200:
-            message = f'Error loading file into OCI bucket  {json_datafile_name}'
-            additional_details = {"jsonDataFilename": json_datafile_name}
-
             message = send_notification(
-                ons_topic_id=param_ons_info_topic_ocid,
+                ons_topic_id=param_ons_error_topic_ocid,
                 title="Data Bucket LoadError",
-                message="Received error whilst writing file to OCI bucket",
+                message="Received error whilst writing reject file to OCI bucket",
                 status="ERROR",
                 additional_details=additional_details)
-
             return return_fn_error(ctx, response, message, json.dumps(additional_details))
+        send_notification(
+            ons_topic_id=param_ons_error_topic_ocid,
+            title=f'Invoices rejected from file {json_datafile_name}',
+            message=f'{len(rejected_invoices)} invalid invoices written to [{param_failed_bucket_name}]',
+            status="WARNING",
+            additional_details=additional_details)
+
+    # Write resulting object to json_inbound_bucket_name, no change extension , enroute
+    # If every invoice was rejected there is nothing to send to ERP
+    ledger = job_ledger.open_ledger(object_storage_client, namespace, param_ledger_bucket_name)
+    if valid_invoice_count > 0:
+        zip_file_name = json_datafile_name.replace('.json', '.zip')
+        # Recorded before the put, which triggers erp-file-load, so the entry always precedes SUBMITTED
+        job_ledger.append_safely(ledger, json_datafile_name, job_ledger.STAGE_TRANSFORMED,
+                                 bucket=param_zip_inbound_bucket_name,
+                                 object_name=zip_file_name,
+                                 content=json_data_file.data.content)
+        with open(transformed_data_file, 'rb') as f:
+            oci_response = object_storage_client.put_object(namespace, param_zip_inbound_bucket_name,
+                                                            zip_file_name, f)
+            if oci_response.status != 200:
+                message = f'Error loading file into OCI bucket  {json_datafile_name}'
+                additional_details = {"jsonDataFilename": json_datafile_name}
+                job_ledger.append_safely(ledger, json_datafile_name, job_ledger.STAGE_FAILED,
+                                         bucket=param_json_inbound_bucket_name,
+                                         object_name=json_datafile_name)
+
+                message = send_notification(
+                    ons_topic_id=param_ons_info_topic_ocid,
+                    title="Data Bucket LoadError",
+                    message="Received error whilst writing file to OCI bucket",
+                    status="ERROR",
+                    additional_details=additional_details)
+
+                return return_fn_error(ctx, response, message, json.dumps(additional_details))
+    else:
+        job_ledger.append_safely(ledger, json_datafile_name, job_ledger.STAGE_REJECTED,
+                                 bucket=param_failed_bucket_name if rejected_invoices else None,
+                                 object_name=reject_file_name if rejected_invoices else None,
+                                 content=json_data_file.data.content)
 
     # Now delete file as its been processed
     if object_storage_client.delete_object(namespace, param_json_inbound_bucket_name, json_datafile_name).status != 204:
@@ -121,6 +178,13 @@ def handler(ctx, data: io.BytesIO = None):
             additional_details=additional_details)
         return return_fn_error(ctx, response, message, json.dumps(additional_details))
 
+    # Nothing was sent to ERP, the rejection has already been notified
+    if valid_invoice_count == 0:
+        message = f'All invoices in datafile [{json_datafile_name}] were rejected, see [{reject_file_name}] ' \
+                  f'in bucket [{param_failed_bucket_name}]'
+        return return_fn_error(ctx, response, message, json.dumps({"jsonDataFilename": json_datafile_name,
+                                                                   "rejectFilename": reject_file_name}))
+
     # Publish Success Message
     ons_body = {"message": "ERP Transform of file " + json_datafile_name + " completed",
                 "filename": json_datafile_name}
@@ -135,7 +199,9 @@ def handler(ctx, data: io.BytesIO = None):
     return response.Response(
         ctx, response_data=json.dumps(
             {
-                "message": f'Datafile [{json_datafile_name}] transformed and put into bucket [{param_zip_inbound_bucket_name}]'}),
+                "message": f'Datafile [{json_datafile_name}] transformed and put into bucket [{param_zip_inbound_bucket_name}]',
+                "validInvoiceCount": valid_invoice_count,
+                "rejectedInvoiceCount": len(rejected_invoices)}),
         headers={"Content-Type": "application/json"}
 
     )
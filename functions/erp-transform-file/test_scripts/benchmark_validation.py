@@ -0,0 +1,141 @@
+# Copyright (c)  2021,  Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+#
+# Checks invoice validation rejects bad values, then measures the cost of validation as a percentage of the transform
+# time. The baseline is a renderer with no validation at all, no type, format or mandatory field checks, producing the
+# same zip file.
+# Runs locally, no OCI access required
+#
+# usage : python3 benchmark_validation.py [number of invoices]
+#
+import copy
+import gc
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import erp_data_file  # noqa: E402
+
+REPEATS = 31
+
+
+def build_invoices(invoice_count):
+    with open(os.path.join(erp_data_file.TEMPLATE_DIR, 'sample_files', 'createInvoiceSample.json'), 'r') as f:
+        sample_invoice = json.load(f)['invoices'][0]
+    invoices = []
+    for i in range(invoice_count):
+        invoice = copy.deepcopy(sample_invoice)
+        invoice['invoiceId'] = str(i)
+        invoice['invoiceNumber'] = str(i)
+        invoice['accountingDate'] = f'2019/{1 + i % 12:02d}/{1 + i % 28:02d}'
+        invoices.append(invoice)
+    return {"invoices": invoices}
+
+
+# Values which must be rejected, as (invoice field, invoice line field, value)
+INVALID_VALUES = (
+    ("accountingDate", None, "2019/13/45"),
+    ("accountingDate", None, "2019/02/01\n"),
+    ("accountingDate", None, "\uff12\uff10\uff11\uff19/02/01"),
+    ("invoiceAmount", None, "12\n"),
+    ("invoiceAmount", None, "\uff11\uff12"),
+    ("invoiceId", None, None),
+    (None, "amount", "\uff11\uff12"),
+)
+
+
+def check_validation(sample_invoice):
+    _, _, errors = erp_data_file.transform_invoice(sample_invoice)
+    assert not errors, errors
+    for invoice_field, line_field, value in INVALID_VALUES:
+        invoice = copy.deepcopy(sample_invoice)
+        if invoice_field:
+            invoice[invoice_field] = value
+        else:
+            invoice['invoiceLines'][0][line_field] = value
+        _, _, errors = erp_data_file.transform_invoice(invoice)
+        assert errors, f'{invoice_field or line_field} = {value!r} should be rejected'
+
+    # null in an optional field is rendered as an empty column
+    invoice = copy.deepcopy(sample_invoice)
+    invoice['description'] = None
+    _, _, errors = erp_data_file.transform_invoice(invoice)
+    assert not errors, errors
+    print("Validation checks passed")
+
+
+def render_without_validation(json_data, zip_file_name):
+    """
+    Baseline transform with no validation at all, only CSV escaping, template rendering and zipping.
+    Keys are still matched case insensitively as the ERP output must be the same.
+    """
+    ap_invoices_interface = []
+    ap_invoice_lines_interface = []
+    for invoice in json_data['invoices']:
+        invoice_values = erp_data_file._TemplateValues()
+        invoice_lines = []
+        for key, value in invoice.items():
+            field = key.upper()
+            if field == erp_data_file.INVOICE_LINES_KEY:
+                invoice_lines = value
+            else:
+                invoice_values[field] = erp_data_file.csv_escape(value)
+        for line_number, invoice_line in enumerate(invoice_lines, start=1):
+            line_values = erp_data_file._TemplateValues(
+                (key.upper(), erp_data_file.csv_escape(value)) for key, value in invoice_line.items())
+            line_values["INVOICELINENUM"] = str(line_number)
+            line_values["INVOICEID"] = invoice_values["INVOICEID"]
+            line_values["ACCOUNTINGDATE"] = invoice_values["ACCOUNTINGDATE"]
+            ap_invoice_lines_interface.append(erp_data_file.INVOICE_LINE_TEMPLATE.format_map(line_values))
+        ap_invoices_interface.append(erp_data_file.INVOICE_TEMPLATE.format_map(invoice_values))
+
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED, False) as zip_file:
+        zip_file.writestr('ApInvoicesInterface.csv', "".join(ap_invoices_interface).encode())
+        zip_file.writestr('ApInvoiceLinesInterface.csv', "".join(ap_invoice_lines_interface).encode())
+    with open(zip_file_name, 'wb') as f:
+        f.write(zip_buffer.getvalue())
+
+
+def time_transform(transform, json_data, zip_file_name):
+    # CPU time with garbage collection paused, the wall clock of a shared container is too noisy for a 10% margin
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.process_time()
+        transform(json_data, zip_file_name)
+        return time.process_time() - start
+    finally:
+        gc.enable()
+
+
+def main():
+    invoice_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    json_data = build_invoices(invoice_count)
+    check_validation(json_data['invoices'][0])
+    zip_file_name = os.path.join(tempfile.gettempdir(), 'benchmark_validation.zip')
+
+    # Alternate runs with and without validation so both see the same machine load, keep the best of each
+    with_validation = without_validation = None
+    for _ in range(REPEATS):
+        elapsed = time_transform(erp_data_file.create_erp_invoices_datafiles, json_data, zip_file_name)
+        with_validation = elapsed if with_validation is None else min(with_validation, elapsed)
+        elapsed = time_transform(render_without_validation, json_data, zip_file_name)
+        without_validation = elapsed if without_validation is None else min(without_validation, elapsed)
+    os.remove(zip_file_name)
+
+    overhead = (with_validation - without_validation) / with_validation * 100
+    print(f'Invoices                     : {invoice_count}')
+    print(f'Transform with validation    : {with_validation:.3f}s')
+    print(f'Transform without validation : {without_validation:.3f}s')
+    print(f'Validation overhead          : {overhead:.1f}% of transform time')
+    return 0 if overhead < 10 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -62,4 +62,28 @@ resource "oci_events_rule" "ServerlessIntegration_PROCESS_ERP_ZIP" {
                 
     display_name = "ServerlessIntegration_PROCESS_ERP_ZIP"
     is_enabled =true
-}
\ No newline at end of file
+}
+
+resource "oci_events_rule" "ServerlessIntegration_COMPACT_JOB_LEDGER" {
+    actions {
+        actions {
+            action_type = "FAAS"
+            is_enabled = "true"
+            function_id= module.functions["erp-ledger-compact"].function_ocid
+            description = "Call erp-ledger-compact to compact the pending job ledger entries"
+        }
+    }
+    compartment_id = var.compartment_ocid
+    condition =  jsonencode({
+                    eventType: "com.oraclecloud.objectstorage.createobject"
+                    data: { resourceName: "pending/*",
+                            additionalDetails: {
+                                bucketName: var.ledger_bucket_name
+                            }
+                        }
+                    }
+                )
+
+    display_name = "ServerlessIntegration_COMPACT_JOB_LEDGER"
+    is_enabled =true
+}
@@ -12,6 +12,7 @@ resource "oci_functions_application" "ServerlessIntegration_App" {
   config = jsondecode(templatefile(var.functionsapp.config_template, {
     apigw = oci_apigateway_gateway.ServerlessIntegration_gateway
     datafile_buckets= var.datafile_buckets
+    ledger_bucket_name = var.ledger_bucket_name
     fnapp = var.functionsapp
     fn = local.functionmap
     ons_error_topic_ocid = oci_ons_notification_topic.ServerlessIntegration_ERROR_TOPIC.id
@@ -36,3 +36,10 @@ resource "oci_objectstorage_bucket" "ServerlessIntegration_SUCCESS" {
     namespace = var.oci-namespace
     object_events_enabled = true
 }
+# Ledger entries written under pending/ raise events which call erp-ledger-compact, see events.tf
+resource "oci_objectstorage_bucket" "ServerlessIntegration_JOB_LEDGER" {
+    compartment_id = var.compartment_ocid
+    name = var.ledger_bucket_name
+    namespace = var.oci-namespace
+    object_events_enabled = true
+}
@@ -151,6 +151,14 @@ variable "datafile_buckets" {
     }
 }
 
+#
+# Bucket holding the job ledger, which records where each data file is in the pipeline
+#
+variable "ledger_bucket_name" {
+    description = "Name of the OCI bucket used for the job ledger"
+    type = string
+    default = "Serverless_Integration_job_ledger"
+}
 
 #
 # Fusion ERP FBDI defaults (for invoices)